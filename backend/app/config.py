@@ -13,4 +13,23 @@ load_dotenv()
 # Get the Grok API key
 GROK_API_KEY = os.environ.get("GROK_API_KEY")
 if not GROK_API_KEY:
-    logger.warning("GROK_API_KEY environment variable is not set. ")
\ No newline at end of file
+    logger.warning("GROK_API_KEY environment variable is not set. ")
+
+# FAISS index description passed to faiss.index_factory (inner-product metric).
+# "SQfp16" stores vectors as float16 (half the memory of "Flat", exact float32 search);
+# "HNSW32,SQfp16" gives approximate O(log n) search for large corpora.
+FAISS_INDEX_FACTORY = os.environ.get("FAISS_INDEX_FACTORY", "SQfp16")
+
+# Directory for the persisted vector store and document metadata
+STORAGE_DIR = os.environ.get("STORAGE_DIR", "storage")
+
+# Directory holding the all-MiniLM-L6-v2 ONNX export (model_quantized.onnx or model.onnx,
+# plus tokenizer.json). SimpleEmbeddings is used if it is missing.
+MINILM_MODEL_DIR = os.environ.get("MINILM_MODEL_DIR", "onnx_model")
+
+# Largest accepted PDF upload
+MAX_UPLOAD_SIZE_MB = int(os.environ.get("MAX_UPLOAD_SIZE_MB", "200"))
+MAX_UPLOAD_SIZE = MAX_UPLOAD_SIZE_MB * 1024 * 1024
+
+# Worker processes (per uvicorn worker) used to split large PDFs into chunks
+SPLIT_WORKERS = max(1, int(os.environ.get("SPLIT_WORKERS", str(min(4, os.cpu_count() or 1)))))
\ No newline at end of file
@@ -1,17 +1,31 @@
 # backend/app/main.py (update)
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from app.routers import documents, chat
 import app.config
+from app.config import MAX_UPLOAD_SIZE, MAX_UPLOAD_SIZE_MB
 from app.utils.error_handler import (
     validation_exception_handler, 
     http_exception_handler, 
     general_exception_handler
 )
 
-app = FastAPI(title="Smart Research Assistant API")
+app = FastAPI(title="Smart Research Assistant API", default_response_class=ORJSONResponse)
+
+# Reject oversized uploads from the Content-Length header, before the body is read.
+# Registered before CORS so the 413 response still carries CORS headers.
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    content_length = request.headers.get("content-length", "")
+    if request.url.path.startswith("/documents/upload") and content_length.isdigit() and int(content_length) > MAX_UPLOAD_SIZE:
+        return ORJSONResponse(
+            status_code=413,
+            content={"detail": f"File too large. Maximum size is {MAX_UPLOAD_SIZE_MB} MB"},
+        )
+    return await call_next(request)
 
 # CORS middleware
 app.add_middleware(
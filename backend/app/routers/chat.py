@@ -1,5 +1,7 @@
 # backend/app/routers/chat.py
 from fastapi import APIRouter, Body
+from fastapi.responses import ORJSONResponse
+from starlette.concurrency import run_in_threadpool
 from app.services.rag_service import rag_service
 from pydantic import BaseModel
 
@@ -12,8 +14,9 @@ class QuestionRequest(BaseModel):
     question: str
     include_sources: bool = True
 
-@router.post("/")
+@router.post("/", response_class=ORJSONResponse)
 async def ask_question(request: QuestionRequest):
     """Ask a question to the RAG system"""
-    result = rag_service.get_answer(request.question, request.include_sources)
+    # get_answer does blocking retrieval and LLM HTTP calls; keep them off the event loop
+    result = await run_in_threadpool(rag_service.get_answer, request.question, request.include_sources)
     return result
\ No newline at end of file
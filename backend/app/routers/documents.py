@@ -1,12 +1,16 @@
 # backend/app/routers/documents.py
 import os
-import shutil
 import logging
 import traceback
 import asyncio
+import aiofiles
+import orjson
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, BackgroundTasks
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from app.services.document_processor import document_processor
 from app.services.rag_service import rag_service
+from app.config import MAX_UPLOAD_SIZE, MAX_UPLOAD_SIZE_MB
 
 
 router = APIRouter(
@@ -22,13 +26,44 @@ logger = logging.getLogger(__name__)
 # Create uploads directory if it doesn't exist
 os.makedirs("uploads", exist_ok=True)
 
+# Read uploads in 1 MB chunks to keep memory bounded
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+def generate_summary(doc_id, filename):
+    """Summarize a document with the RAG service, caching the summary if the LLM produced it"""
+    # Create a prompt for summarization
+    prompt = f"""
+        Please provide a concise summary of the document titled '{filename}'. 
+        Focus on the main points, key findings, and important conclusions. 
+        Structure the summary with bullet points for clarity.
+        """
+    
+    # Use the RAG service to generate a summary
+    logger.info(f"Generating summary for document: {filename}")
+    # Summary prompts for different documents differ only in the filename, so they would
+    # hit each other's entries in the semantic answer cache
+    result, answered_by_llm = rag_service.get_answer_with_status(prompt, include_sources=False, use_cache=False)
+    # Don't cache fallback text; the next request should retry the LLM
+    if answered_by_llm:
+        document_processor.summaries[doc_id] = result["answer"]
+    return result["answer"]
+
+def precompute_summary(doc_id, filename):
+    """Generate a summary after upload so the first /summarize call is served from cache"""
+    try:
+        generate_summary(doc_id, filename)
+    except Exception as e:
+        logger.error(f"Error precomputing summary for {filename}: {str(e)}", exc_info=True)
+
 # Function to process document in background
 async def process_document_task(file_path, filename):
     """Process document in background"""
     try:
         logger.info(f"Background task: Processing document {filename}")
-        result = document_processor.process_pdf(file_path, filename)
+        result = await run_in_threadpool(document_processor.process_pdf, file_path, filename)
         logger.info(f"Background task completed for {filename}: {result}")
+        if result.get("success", False):
+            await run_in_threadpool(precompute_summary, result["doc_id"], filename)
         return result
     except Exception as e:
         logger.error(f"Error in background task: {str(e)}")
@@ -37,7 +72,7 @@ async def process_document_task(file_path, filename):
             os.remove(file_path)
         return {"success": False, "error": str(e)}
 
-@router.post("/upload")
+@router.post("/upload", response_class=ORJSONResponse)
 async def upload_document(file: UploadFile = File(...), background_tasks: BackgroundTasks = None):
     """Upload a document (PDF) for processing"""
     if not file.filename.lower().endswith('.pdf'):
@@ -46,13 +81,23 @@ async def upload_document(file: UploadFile = File(...), background_tasks: Backgr
     # Save the file temporarily
     file_path = f"uploads/{file.filename}"
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        file_size = 0
+        async with aiofiles.open(file_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                file_size += len(chunk)
+                # Stop as soon as the limit is crossed rather than writing the rest
+                if file_size > MAX_UPLOAD_SIZE:
+                    break
+                await buffer.write(chunk)
+        
+        if file_size > MAX_UPLOAD_SIZE:
+            logger.warning(f"Rejected upload {file.filename}: larger than {MAX_UPLOAD_SIZE_MB} MB")
+            os.remove(file_path)
+            raise HTTPException(status_code=413, detail=f"File too large. Maximum size is {MAX_UPLOAD_SIZE_MB} MB")
         
         logger.info(f"File saved to {file_path}")
         
         # Check file size
-        file_size = os.path.getsize(file_path)
         file_size_mb = file_size / (1024*1024)
         logger.info(f"File size: {file_size_mb:.2f} MB")
         
@@ -66,14 +111,16 @@ async def upload_document(file: UploadFile = File(...), background_tasks: Backgr
                 "message": f"Large file ({file_size_mb:.2f} MB) is being processed in the background. Please check back in a few moments."
             }
         
-        # For smaller files, process synchronously
-        result = document_processor.process_pdf(file_path, file.filename)
+        # For smaller files, process before responding (off the event loop)
+        result = await run_in_threadpool(document_processor.process_pdf, file_path, file.filename)
         
         if not result.get("success", False):
             logger.error(f"Processing failed: {result.get('error', 'Unknown error')}")
             raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
         
         logger.info(f"Document processed successfully: {result}")
+        if background_tasks:
+            background_tasks.add_task(precompute_summary, result["doc_id"], file.filename)
         return result
     except HTTPException:
         # Re-raise HTTP exceptions
@@ -85,45 +132,47 @@ async def upload_document(file: UploadFile = File(...), background_tasks: Backgr
             os.remove(file_path)
         raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
 
+def stream_documents_json():
+    """Encode the document map as a JSON object one entry at a time"""
+    yield b"{"
+    for i, (doc_id, doc_info) in enumerate(document_processor.get_all_documents()):
+        if i:
+            yield b","
+        yield orjson.dumps(doc_id) + b":" + orjson.dumps(doc_info)
+    yield b"}"
+
 @router.get("/")
 async def get_all_documents():
     """Get all processed documents"""
-    return document_processor.get_all_documents()
+    return StreamingResponse(stream_documents_json(), media_type="application/json")
 
 
-@router.post("/{doc_id}/summarize")
+@router.post("/{doc_id}/summarize", response_class=ORJSONResponse)
 async def summarize_document(doc_id: str):
     """Generate a summary of a document"""
     # Check if document exists
-    documents = document_processor.get_all_documents()
-    if doc_id not in documents:
+    doc_info = document_processor.get_document(doc_id)
+    if doc_info is None:
         raise HTTPException(status_code=404, detail="Document not found")
     
     try:
-        # Get document info
-        doc_info = documents[doc_id]
-        
-        # Create a prompt for summarization
-        prompt = f"""
-        Please provide a concise summary of the document titled '{doc_info['filename']}'. 
-        Focus on the main points, key findings, and important conclusions. 
-        Structure the summary with bullet points for clarity.
-        """
-        
-        # Use the RAG service to generate a summary
-        logger.info(f"Generating summary for document: {doc_info['filename']}")
-        result = rag_service.get_answer(prompt, include_sources=False)
+        # Documents don't change after upload, so reuse a summary generated earlier
+        summary = document_processor.summaries.get(doc_id)
+        if summary is None:
+            summary = await run_in_threadpool(generate_summary, doc_id, doc_info['filename'])
+        else:
+            logger.info(f"Using cached summary for document: {doc_info['filename']}")
         
         return {
             "doc_id": doc_id,
             "filename": doc_info['filename'],
-            "summary": result["answer"]
+            "summary": summary
         }
     except Exception as e:
         logger.error(f"Error generating summary: {str(e)}", exc_info=True)
         # Provide a fallback summary
         return {
             "doc_id": doc_id,
-            "filename": documents[doc_id]['filename'],
+            "filename": doc_info['filename'],
             "summary": "This is a placeholder summary. The document contains information that would normally be summarized by the AI. Due to technical limitations with the current model configuration, a detailed summary could not be generated automatically."
         }
\ No newline at end of file
@@ -1,31 +1,399 @@
 # backend/app/services/document_processor.py
 import os
 import uuid
-import time
+import hashlib
+import pickle
+import shutil
+import threading
 import logging
-import numpy as np
-from langchain_community.document_loaders import PyPDFLoader
+import multiprocessing
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+import faiss
+import fitz  # PyMuPDF
+from langchain_core.documents import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from app.utils.grok_integration import SimpleEmbeddings
-from app.config import GROK_API_KEY  # Import from config
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from app.services.document_store import DocumentStore
+from app.services.pdf_splitter import split_batch
+from app.utils.grok_integration import MiniLMEmbeddings, SimpleEmbeddings
+from app.config import FAISS_INDEX_FACTORY, STORAGE_DIR, MINILM_MODEL_DIR, SPLIT_WORKERS  # Import from config
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, so run a single worker there
+    fcntl = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Process pool for splitting large documents, shared by all uploads in this worker.
+# Workers come from a forkserver (spawn on platforms without one) rather than fork,
+# since forking a process that is running threads (uvicorn, FAISS, ONNX Runtime) can deadlock.
+_split_pool = None
+_split_pool_lock = threading.Lock()
+
+def _get_split_pool():
+    global _split_pool
+    with _split_pool_lock:
+        if _split_pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _split_pool = ProcessPoolExecutor(
+                max_workers=SPLIT_WORKERS,
+                mp_context=multiprocessing.get_context(method),
+            )
+        return _split_pool
+
+def _discard_split_pool(pool):
+    """Drop a broken pool so the next upload starts a fresh one"""
+    global _split_pool
+    with _split_pool_lock:
+        if _split_pool is pool:
+            _split_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+class _ReadWriteLock:
+    """Lets any number of readers in at once, or a single writer.
+
+    Waiting writers go first so a steady stream of queries can't starve uploads.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
 class DocumentProcessor:
     def __init__(self):
-        # Use SimpleEmbeddings directly since Grok doesn't support the embedding model we need
-        self.embeddings = SimpleEmbeddings()
-        logger.info("DocumentProcessor initialized with SimpleEmbeddings")
+        # Grok doesn't provide the embedding model we need, so run MiniLM locally,
+        # falling back to SimpleEmbeddings if the ONNX model or runtime isn't available
+        try:
+            self.embeddings = MiniLMEmbeddings(MINILM_MODEL_DIR)
+            logger.info("DocumentProcessor initialized with MiniLMEmbeddings")
+        except Exception as e:
+            logger.warning(f"MiniLMEmbeddings unavailable ({str(e)}), using SimpleEmbeddings")
+            self.embeddings = SimpleEmbeddings()
+            logger.info("DocumentProcessor initialized with SimpleEmbeddings")
             
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200
         )
         self.vector_store = None
-        self.documents = {}  # To track documents and their metadata
+        # To track documents and their metadata; kept on disk rather than in memory
+        self.documents = DocumentStore(os.path.join(STORAGE_DIR, "docs.db"))
+        # Generated summaries by doc_id; documents don't change after upload, so these stay valid
+        self.summaries = DocumentStore(os.path.join(STORAGE_DIR, "docs.db"), table="summaries")
+        # Uploads and queries run in worker threads. FAISS can't search an index while
+        # it is being added to, so searches share this lock and updates take it exclusively
+        self._lock = _ReadWriteLock()
+        
+        self.index_dir = os.path.join(STORAGE_DIR, "faiss")
+        self.index_path = os.path.join(self.index_dir, "index.faiss")
+        # Counter bumped on every save, so workers can tell when to reload (file mtimes
+        # are too coarse on some filesystems to tell two quick saves apart)
+        self.generation_path = os.path.join(self.index_dir, "generation")
+        self.lock_path = os.path.join(STORAGE_DIR, ".lock")
+        # Generation of the saved index we last loaded or wrote, and whether the
+        # in-memory index can be added to (memory-mapped indexes are read-only)
+        self._index_generation = None
+        self._index_writable = True
+        self._load_state()
+
+    @contextmanager
+    def _storage_lock(self, exclusive=True, blocking=True):
+        """Lock the storage directory across worker processes.
+
+        Yields False instead of waiting if blocking is False and the lock is held elsewhere.
+        """
+        if fcntl is None:
+            yield True
+            return
+        os.makedirs(STORAGE_DIR, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock_file, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _saved_index_generation(self):
+        """Generation of the saved index, or None if nothing has been saved"""
+        if not os.path.exists(self.index_path):
+            return None
+        try:
+            with open(self.generation_path) as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            # Saved before generations were tracked
+            return 0
+
+    def _read_index(self, mmap):
+        """Read the saved FAISS index, memory-mapped if requested and supported"""
+        # IO_FLAG_MMAP_IFC maps flat/scalar-quantized codes straight from the file (faiss >= 1.10)
+        mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+        if mmap and mmap_flag is not None:
+            try:
+                return faiss.read_index(self.index_path, mmap_flag | faiss.IO_FLAG_READ_ONLY), False
+            except RuntimeError as e:
+                logger.warning(f"Could not memory-map FAISS index, reading it into memory: {str(e)}")
+        return faiss.read_index(self.index_path), True
+
+    def reload_index(self, writable=False):
+        """Load the vector store last saved by any worker.
+
+        Read-only loads are memory-mapped, so all workers share the OS page cache for the
+        vectors; pass writable=True to get an in-memory copy that can be added to.
+        """
+        generation = self._saved_index_generation()
+        index, is_writable = self._read_index(mmap=not writable)
+        with open(os.path.join(self.index_dir, "index.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        
+        if index.d != self.embeddings.embedding_dim:
+            raise ValueError(
+                f"Saved index has dimension {index.d}, expected {self.embeddings.embedding_dim}"
+            )
+        
+        vector_store = FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id,
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+        )
+        with self._lock.write():
+            self.vector_store = vector_store
+            self._index_generation = generation
+            self._index_writable = is_writable
+        logger.info(f"Loaded vector store with {index.ntotal} chunks from {self.index_dir}")
+
+    def _load_state(self):
+        """Restore the vector store saved by a previous run"""
+        if self._saved_index_generation() is None:
+            # The metadata tables are shared by all workers; another worker may be saving
+            # its first upload right now, so only clear them if the index is still missing
+            # once we hold the exclusive lock
+            with self._storage_lock():
+                if self._saved_index_generation() is None:
+                    logger.info("No saved vector store found, starting empty")
+                    self.documents.clear()
+                    self.summaries.clear()
+                    return
+        try:
+            with self._storage_lock(exclusive=False):
+                self.reload_index()
+        except Exception as e:
+            # Leave the shared metadata alone: the saved index may be fine for other workers
+            logger.error(f"Failed to load saved vector store, starting empty in this worker: {str(e)}", exc_info=True)
+            return
+        
+        logger.info(f"Loaded {len(self.documents)} documents from {STORAGE_DIR}")
+
+    def _save_state(self):
+        """Persist the vector store, replacing files atomically"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        
+        generation = (self._saved_index_generation() or 0) + 1
+        tmp_dir = self.index_dir + ".tmp"
+        self.vector_store.save_local(tmp_dir)
+        # Replace the docstore before the index, and bump the generation last:
+        # readers reload when the generation changes
+        for name in sorted(os.listdir(tmp_dir), key=lambda name: name.endswith(".faiss")):
+            os.replace(os.path.join(tmp_dir, name), os.path.join(self.index_dir, name))
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_path = self.generation_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(generation))
+        os.replace(tmp_path, self.generation_path)
+        self._index_generation = generation
+        logger.info(f"Saved vector store to {STORAGE_DIR}")
+
+    def _new_vector_store(self):
+        """Create an empty FAISS store that ranks by inner product (cosine on normalized vectors)"""
+        index = faiss.index_factory(
+            self.embeddings.embedding_dim, FAISS_INDEX_FACTORY, faiss.METRIC_INNER_PRODUCT
+        )
+        logger.info(f"Creating FAISS index '{FAISS_INDEX_FACTORY}' with inner-product metric")
+        return FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={},
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+        )
+
+    def _add_chunks(self, chunks, seen_hashes=None):
+        """Embed chunks in a single batched call and add them to the vector store.
+
+        Chunks whose content hash is already in seen_hashes (repeated headers, footers,
+        boilerplate) are skipped. Returns the number of chunks added.
+        """
+        if seen_hashes is not None:
+            unique_chunks = []
+            for chunk in chunks:
+                content_hash = hashlib.blake2b(chunk.page_content.encode(), digest_size=16).digest()
+                if content_hash not in seen_hashes:
+                    seen_hashes.add(content_hash)
+                    unique_chunks.append(chunk)
+            if len(unique_chunks) < len(chunks):
+                logger.info(f"Skipped {len(chunks) - len(unique_chunks)} duplicate chunks")
+            chunks = unique_chunks
+        if not chunks:
+            return 0
+        texts = [chunk.page_content for chunk in chunks]
+        vectors = self.embeddings.embed_documents_np(texts)
+        with self._lock.write():
+            # Initialize vector store if needed
+            if self.vector_store is None:
+                logger.info("Initializing vector store")
+                self.vector_store = self._new_vector_store()
+            self.vector_store.add_embeddings(
+                list(zip(texts, vectors)),
+                metadatas=[chunk.metadata for chunk in chunks],
+            )
+        return len(chunks)
+
+    def _load_pages(self, file_path, filename):
+        """Extract one Document per page, using PyMuPDF with PyPDFLoader as a fallback"""
+        try:
+            doc = fitz.open(file_path)
+            try:
+                return [
+                    Document(page_content=page.get_text("text"), metadata={"source": filename, "page": i})
+                    for i, page in enumerate(doc)
+                ]
+            finally:
+                doc.close()
+        except Exception as e:
+            # PyMuPDF can reject some malformed PDFs that pypdf still manages to read
+            logger.warning(f"PyMuPDF failed to read {file_path}, falling back to PyPDFLoader: {str(e)}")
+            # Imported here since it is only needed for the rare fallback path
+            from langchain_community.document_loaders import PyPDFLoader
+            pages = PyPDFLoader(file_path).load()
+            for page in pages:
+                page.metadata["source"] = filename
+            return pages
+
+    def _add_pages(self, pages, file_path):
+        """Split pages into chunks and add them to the vector store; returns the number of chunks added"""
+        # Split into chunks with better logging and handling for large files
+        logger.info(f"Splitting {len(pages)} pages into chunks")
+        
+        # Process in batches for very large documents to avoid memory issues.
+        # Each batch is embedded and added to the vector store as soon as it is split,
+        # so only a few batches of chunks are held in memory at once.
+        num_chunks = 0
+        seen_hashes = set()
+        batch_size = 10  # Process 10 pages at a time for very large docs
+        
+        if len(pages) > 50:  # For large documents
+            logger.info(f"Large document detected ({len(pages)} pages). Processing in batches of {batch_size}.")
+            
+            def add_batch(start, future):
+                batch_chunks = future.result()
+                batch_end = min(start + batch_size, len(pages))
+                logger.info(f"Created {len(batch_chunks)} chunks from pages {start+1}-{batch_end} of {len(pages)}")
+                return self._add_chunks(batch_chunks, seen_hashes)
+            
+            # Splitting is CPU-bound pure Python, so spread batches across processes,
+            # keeping at most one pending batch per worker
+            executor = _get_split_pool()
+            in_flight = deque()
+            try:
+                for i in range(0, len(pages), batch_size):
+                    in_flight.append((i, executor.submit(split_batch, pages[i:i + batch_size])))
+                    if len(in_flight) >= SPLIT_WORKERS:
+                        num_chunks += add_batch(*in_flight.popleft())
+                while in_flight:
+                    num_chunks += add_batch(*in_flight.popleft())
+            except BrokenProcessPool:
+                _discard_split_pool(executor)
+                raise
+            finally:
+                # Don't leave this upload's batches queued ahead of the next one
+                for _, future in in_flight:
+                    future.cancel()
+        else:
+            # For smaller documents, process all at once
+            chunks = self.text_splitter.split_documents(pages)
+            logger.info(f"Created {len(chunks)} chunks")
+            num_chunks = self._add_chunks(chunks, seen_hashes)
+        
+        # Check if we have any chunks
+        if num_chunks == 0:
+            # Try a fallback method - extract text directly
+            logger.warning(f"No chunks created from {file_path}. Attempting fallback text extraction.")
+            
+            fallback_chunks = []
+            for i, page in enumerate(pages):
+                if page.page_content and len(page.page_content.strip()) > 0:
+                    fallback_chunks.append(page)
+                    logger.info(f"Extracted text directly from page {i+1}")
+            
+            if fallback_chunks:
+                logger.info(f"Fallback extraction successful. Got {len(fallback_chunks)} text chunks.")
+                num_chunks = self._add_chunks(fallback_chunks, seen_hashes)
+            else:
+                logger.warning(f"Fallback extraction failed. No text content found in {file_path}")
+        
+        return num_chunks
+
+    def _discard_unsaved_chunks(self):
+        """Go back to the last saved vector store, dropping chunks added since (call with the storage lock held)"""
+        try:
+            if self._saved_index_generation() is None:
+                with self._lock.write():
+                    self.vector_store = None
+                    self._index_writable = True
+            else:
+                self.reload_index(writable=True)
+            logger.info("Discarded unsaved chunks from the vector store")
+        except Exception as e:
+            logger.error(f"Failed to roll back vector store: {str(e)}", exc_info=True)
 
     def process_pdf(self, file_path, filename):
         """Process a PDF document and store its chunks in the vector store"""
@@ -39,8 +407,7 @@ class DocumentProcessor:
             # Load PDF with better error handling
             logger.info(f"Loading PDF: {file_path}")
             try:
-                loader = PyPDFLoader(file_path)
-                pages = loader.load()
+                pages = self._load_pages(file_path, filename)
                 
                 if not pages:
                     logger.warning(f"No pages found in {file_path}")
@@ -51,68 +418,39 @@ class DocumentProcessor:
                 logger.error(f"Error loading PDF: {str(e)}", exc_info=True)
                 return {"success": False, "error": f"Failed to load PDF: {str(e)}"}
             
-            # Split into chunks with better logging and handling for large files
-            logger.info(f"Splitting {len(pages)} pages into chunks")
-            
-            # Process in batches for very large documents to avoid memory issues
-            all_chunks = []
-            batch_size = 10  # Process 10 pages at a time for very large docs
-            
-            if len(pages) > 50:  # For large documents
-                logger.info(f"Large document detected ({len(pages)} pages). Processing in batches of {batch_size}.")
+            # Hold the storage lock for the whole update so uploads on other workers
+            # can't save over each other's chunks
+            with self._storage_lock():
+                # Pick up chunks saved by other workers, in a copy we can add to
+                saved_generation = self._saved_index_generation()
+                if saved_generation is not None and (saved_generation != self._index_generation or not self._index_writable):
+                    self.reload_index(writable=True)
                 
-                for i in range(0, len(pages), batch_size):
-                    batch_end = min(i + batch_size, len(pages))
-                    logger.info(f"Processing batch of pages {i+1} to {batch_end} of {len(pages)}")
-                    
-                    batch_pages = pages[i:batch_end]
-                    batch_chunks = self.text_splitter.split_documents(batch_pages)
-                    
-                    logger.info(f"Created {len(batch_chunks)} chunks from pages {i+1}-{batch_end}")
-                    all_chunks.extend(batch_chunks)
-                    
-                    # Add a small delay to prevent potential memory issues
-                    if len(pages) > 100:
-                        time.sleep(0.1)
-            else:
-                # For smaller documents, process all at once
-                all_chunks = self.text_splitter.split_documents(pages)
-                logger.info(f"Created {len(all_chunks)} chunks")
-            
-            # Check if we have any chunks
-            if not all_chunks:
-                # Try a fallback method - extract text directly
-                logger.warning(f"No chunks created from {file_path}. Attempting fallback text extraction.")
-                
-                fallback_chunks = []
-                for i, page in enumerate(pages):
-                    if page.page_content and len(page.page_content.strip()) > 0:
-                        fallback_chunks.append(page)
-                        logger.info(f"Extracted text directly from page {i+1}")
-                
-                if fallback_chunks:
-                    logger.info(f"Fallback extraction successful. Got {len(fallback_chunks)} text chunks.")
-                    all_chunks = fallback_chunks
-                else:
-                    logger.warning(f"Fallback extraction failed. No text content found in {file_path}")
+                try:
+                    num_chunks = self._add_pages(pages, file_path)
+                except Exception:
+                    # Don't leave a failed upload's chunks in the index, where they would
+                    # answer questions and be saved by the next upload
+                    self._discard_unsaved_chunks()
+                    raise
+                if num_chunks == 0:
                     return {"success": False, "error": "Failed to extract text from PDF. The file may be scanned or contain only images."}
-            
-            # Initialize vector store if needed
-            if self.vector_store is None:
-                logger.info("Initializing vector store")
-                self.vector_store = FAISS.from_documents(all_chunks, self.embeddings)
-            else:
-                logger.info("Adding to existing vector store")
-                self.vector_store.add_documents(all_chunks)
-            
-            # Store document metadata
-            self.documents[doc_id] = {
-                "filename": filename,
-                "path": file_path,
-                "num_pages": len(pages),
-                "num_chunks": len(all_chunks),
-                "file_size_mb": file_size_mb
-            }
+                
+                with self._lock.write():
+                    # Store document metadata
+                    self.documents[doc_id] = {
+                        "filename": filename,
+                        "path": file_path,
+                        "num_pages": len(pages),
+                        "num_chunks": num_chunks,
+                        "file_size_mb": file_size_mb
+                    }
+                    
+                    try:
+                        self._save_state()
+                    except Exception as e:
+                        # The document is still usable in memory; it just won't survive a restart
+                        logger.error(f"Failed to persist vector store: {str(e)}", exc_info=True)
             
             # Remove the temporary file
             if os.path.exists(file_path):
@@ -124,7 +462,7 @@ class DocumentProcessor:
                 "doc_id": doc_id,
                 "filename": filename,
                 "num_pages": len(pages),
-                "num_chunks": len(all_chunks)
+                "num_chunks": num_chunks
             }
             
         except Exception as e:
@@ -137,18 +475,53 @@ class DocumentProcessor:
             return {"success": False, "error": str(e)}
     
     def get_all_documents(self):
-        """Get a list of all processed documents"""
-        return self.documents
+        """Iterate over (doc_id, metadata) pairs for all processed documents"""
+        return self.documents.items()
     
+    def get_document(self, doc_id):
+        """Get the metadata of a single document, or None if it doesn't exist"""
+        return self.documents.get(doc_id)
+    
+    @lru_cache(maxsize=1024)
+    def _embed_query(self, text):
+        """Embed a query, memoized so repeated questions skip the embedding call"""
+        # Read-only, so cached vectors cannot be modified by callers
+        vector = self.embeddings.embed_query_np(text)
+        vector.flags.writeable = False
+        return vector
+
+    def get_query_embedding(self, query):
+        """Get the (cached) embedding vector for a query"""
+        return self._embed_query(query)
+
+    def refresh_if_stale(self):
+        """Reload the vector store if another worker has saved a newer one"""
+        saved_generation = self._saved_index_generation()
+        if saved_generation is None or saved_generation == self._index_generation:
+            return
+        # Don't wait behind an upload in progress; keep serving the current index instead
+        with self._storage_lock(exclusive=False, blocking=False) as locked:
+            if locked:
+                try:
+                    self.reload_index()
+                except Exception as e:
+                    logger.error(f"Failed to reload vector store: {str(e)}", exc_info=True)
+
     def get_relevant_documents(self, query, k=4):
         """Get relevant document chunks for a query"""
+        self.refresh_if_stale()
         if self.vector_store is None:
             logger.warning("No documents in vector store")
             return []
             
         try:
             logger.info(f"Retrieving relevant documents for query: {query}")
-            docs = self.vector_store.similarity_search(query, k=k)
+            query_vector = self._embed_query(query)
+            with self._lock.read():
+                # A failed upload may have rolled the store back to empty since the check above
+                if self.vector_store is None:
+                    return []
+                docs = self.vector_store.similarity_search_by_vector(query_vector, k=k)
             logger.info(f"Found {len(docs)} relevant documents")
             return docs
         except Exception as e:
@@ -0,0 +1,70 @@
+# backend/app/services/document_store.py
+import os
+import sqlite3
+import threading
+import orjson
+
+
+class DocumentStore:
+    """Dict-like document metadata store backed by SQLite, so values live on disk until accessed"""
+
+    def __init__(self, path, table="documents"):
+        if not table.isidentifier():
+            raise ValueError(f"Invalid table name: {table}")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.table = table
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (id TEXT PRIMARY KEY, value BLOB NOT NULL)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO {self.table} (id, value) VALUES (?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET value = excluded.value",
+                (key, orjson.dumps(value)),
+            )
+            self._conn.commit()
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        with self._lock:
+            row = self._conn.execute(f"SELECT 1 FROM {self.table} WHERE id = ?", (key,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute(f"SELECT value FROM {self.table} WHERE id = ?", (key,)).fetchone()
+        return orjson.loads(row[0]) if row is not None else default
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+
+    def items(self, batch_size=100):
+        """Iterate over (doc_id, metadata) pairs in insertion order, reading a batch at a time"""
+        last_rowid = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT rowid, id, value FROM {self.table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last_rowid, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            for _, key, value in rows:
+                yield key, orjson.loads(value)
+            last_rowid = rows[-1][0]
@@ -0,0 +1,10 @@
+# backend/app/services/pdf_splitter.py
+# Runs in the split worker processes, so keep imports light: importing
+# document_processor there would load the embedding model and vector store.
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+
+def split_batch(batch_pages):
+    """Split a batch of pages into chunks (runs in a worker process)"""
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    return text_splitter.split_documents(batch_pages)
@@ -1,7 +1,9 @@
 # backend/app/services/rag_service.py
 import os
 import logging
-from langchain.chains import RetrievalQA
+import threading
+import faiss
+import numpy as np
 from langchain.prompts import PromptTemplate
 from app.services.document_processor import document_processor
 from app.utils.grok_integration import GrokChatModel
@@ -11,6 +13,58 @@ from app.utils.grok_integration import GrokChatModel
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class SemanticAnswerCache:
+    """Cache of recent answers, looked up by cosine similarity of the question embedding"""
+
+    def __init__(self, max_entries=512, threshold=0.95):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._index = None
+        self._vectors = []
+        self._entries = []
+        self._next_slot = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector):
+        vec = np.asarray(vector, dtype=np.float32).reshape(1, -1)
+        return vec / (np.linalg.norm(vec) + 1e-12)
+
+    def clear(self):
+        with self._lock:
+            self._index = None
+            self._vectors = []
+            self._entries = []
+            self._next_slot = 0
+
+    def lookup(self, vector):
+        """Return the cached entry for the most similar question, if it is close enough"""
+        vec = self._normalize(vector)
+        with self._lock:
+            if self._index is None or self._index.ntotal == 0:
+                return None
+            scores, ids = self._index.search(vec, 1)
+            if ids[0][0] >= 0 and scores[0][0] > self.threshold:
+                return self._entries[ids[0][0]]
+        return None
+
+    def add(self, vector, entry):
+        vec = self._normalize(vector)
+        with self._lock:
+            if self._index is None:
+                self._index = faiss.IndexFlatIP(vec.shape[1])
+            if len(self._entries) < self.max_entries:
+                self._index.add(vec)
+                self._vectors.append(vec[0])
+                self._entries.append(entry)
+                return
+            # Ring buffer is full: overwrite the oldest slot and rebuild the (small) index
+            self._vectors[self._next_slot] = vec[0]
+            self._entries[self._next_slot] = entry
+            self._next_slot = (self._next_slot + 1) % self.max_entries
+            self._index.reset()
+            self._index.add(np.vstack(self._vectors))
+
 class RAGService:
     def __init__(self):
         try:
@@ -23,7 +77,8 @@ class RAGService:
             logger.info("Using GrokChatModel")
         except Exception as e:
             logger.error(f"Failed to initialize GrokChatModel: {str(e)}")
-            # No fallback needed as GrokChatModel has its own internal fallback
+            # get_answer_with_status falls back to document excerpts without an LLM
+            self.llm = None
             
         self.qa_prompt_template = """
         You are a helpful AI research assistant. Use the following pieces of context to answer the question at the end.
@@ -37,9 +92,49 @@ class RAGService:
         
         Answer:
         """
+        self.prompt = PromptTemplate(
+            template=self.qa_prompt_template,
+            input_variables=["context", "question"]
+        )
+        # Retrieval happens in get_answer_with_status (reusing the cached query embedding),
+        # so the chain only stuffs the retrieved chunks into the prompt and calls the LLM
+        self.chain = self.prompt | self.llm if self.llm is not None else None
+
+        self.answer_cache = SemanticAnswerCache()
+        # Number of vectors in the store when the cache was filled; answers go stale on upload
+        self._answer_cache_ntotal = None
     
     def get_answer(self, question, include_sources=True):
         """Generate an answer for the given question using RAG"""
+        result, _ = self.get_answer_with_status(question, include_sources)
+        return result
+    
+    def get_answer_with_status(self, question, include_sources=True, use_cache=True):
+        """Like get_answer, but also report whether the answer came from the LLM (not a fallback).
+
+        Pass use_cache=False for templated prompts that differ only in a few words
+        (e.g. document summaries), which the semantic cache can't tell apart.
+        """
+        # Pick up documents uploaded through other workers first, so the size check
+        # below sees them and drops answers cached before the upload
+        document_processor.refresh_if_stale()
+        
+        # Return a cached answer for the same (or an equivalent) question
+        question_vector = None
+        if use_cache and document_processor.vector_store is not None:
+            store_size = document_processor.vector_store.index.ntotal
+            if store_size != self._answer_cache_ntotal:
+                self.answer_cache.clear()
+                self._answer_cache_ntotal = store_size
+            question_vector = document_processor.get_query_embedding(question)
+            cached = self.answer_cache.lookup(question_vector)
+            if cached is not None:
+                logger.info("Returning cached answer for semantically equivalent question")
+                return {
+                    "answer": cached["answer"],
+                    "sources": cached["sources"] if include_sources else []
+                }, True
+        
         # Get relevant documents
         logger.info(f"Getting relevant documents for: {question}")
         relevant_docs = document_processor.get_relevant_documents(question)
@@ -49,39 +144,48 @@ class RAGService:
             return {
                 "answer": "I don't have enough information to answer that question. Please upload relevant documents first.",
                 "sources": []
-            }
+            }, False
         
-        # Format context for the prompt
-        context_text = "\n\n".join([doc.page_content for doc in relevant_docs])
         logger.info(f"Found {len(relevant_docs)} relevant documents")
         
+        # Format sources once; they are built even when not requested so cached
+        # entries can serve both cases, and the fallback answer reuses the snippets
+        sources = []
+        seen_sources = set()
+        for doc in relevant_docs:
+            source = doc.metadata.get("source", "Unknown")
+            page = doc.metadata.get("page", 0)
+            if (source, page) not in seen_sources:
+                seen_sources.add((source, page))
+                content = doc.page_content
+                sources.append({
+                    "source": source,
+                    "page": page,
+                    "snippet": content[:200] + "..." if len(content) > 200 else content
+                })
+        
         # Try to use the LLM chain, but provide fallbacks
+        answered_by_llm = False
         try:
-            # Create prompt
-            prompt = PromptTemplate(
-                template=self.qa_prompt_template,
-                input_variables=["context", "question"]
-            )
-            
-            # Create chain
-            chain = RetrievalQA.from_chain_type(
-                llm=self.llm,
-                chain_type="stuff",
-                retriever=document_processor.vector_store.as_retriever(),
-                chain_type_kwargs={"prompt": prompt}
-            )
-            
             # Get answer
             logger.info("Invoking LLM chain")
-            result = chain.invoke({"query": question})
-            answer = result["result"]
+            if self.chain is None:
+                raise ValueError("No LLM available")
+            context = "\n\n".join(doc.page_content for doc in relevant_docs)
+            response = self.chain.invoke({"context": context, "question": question})
+            # GrokChatModel returns a flagged placeholder instead of raising for some
+            # failures; use the excerpt fallback and keep it out of the caches
+            if response.response_metadata.get("placeholder"):
+                raise ValueError("LLM returned a placeholder response")
+            answer = response.content
+            answered_by_llm = True
             logger.info("Got answer from LLM")
         except Exception as e:
             logger.error(f"Error in RAG chain: {str(e)}", exc_info=True)
             
             # Create a more helpful fallback response based on the documents
-            snippets = [doc.page_content[:150] + "..." for doc in relevant_docs[:2]]
-            doc_names = list(set([doc.metadata.get("source", "Unknown") for doc in relevant_docs]))
+            snippets = [src["snippet"] for src in sources[:2]]
+            doc_names = list(dict.fromkeys(src["source"] for src in sources))
             
             if "summarize" in question.lower():
                 answer = f"Here's a summary based on the document(s): {', '.join(doc_names)}\n\n"
@@ -95,26 +199,14 @@ class RAGService:
                     answer += f"{i+1}. {snippet}\n\n"
                 answer += "Try asking a more specific question about this content."
         
-        # Format sources if requested
-        sources = []
-        if include_sources:
-            seen_sources = set()
-            for doc in relevant_docs:
-                source = doc.metadata.get("source", "Unknown")
-                page = doc.metadata.get("page", 0)
-                source_key = f"{source}-{page}"
-                if source_key not in seen_sources:
-                    sources.append({
-                        "source": source,
-                        "page": page,
-                        "snippet": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content
-                    })
-                    seen_sources.add(source_key)
+        # Only cache real LLM answers, and only if no upload landed while we were answering
+        if answered_by_llm and question_vector is not None and store_size == self._answer_cache_ntotal:
+            self.answer_cache.add(question_vector, {"answer": answer, "sources": sources})
         
         return {
             "answer": answer,
-            "sources": sources
-        }
+            "sources": sources if include_sources else []
+        }, answered_by_llm
     
 # Create a singleton instance
 rag_service = RAGService()
\ No newline at end of file
@@ -1,23 +1,249 @@
 # backend/app/utils/grok_integration.py
-import json
+from __future__ import annotations
+
+import time
+import asyncio
+import weakref
+import hashlib
+import functools
+import importlib.util
+import threading
 import requests
-from typing import Any, Dict, List, Mapping, Optional, Union
-from langchain_core.callbacks import CallbackManagerForLLMRun
+import httpx
+import orjson
+import cachetools
+import tenacity
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Mapping, Optional, Union
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.embeddings import Embeddings
 from langchain_core.messages import (
     AIMessage,
+    AIMessageChunk,
     BaseMessage,
     HumanMessage,
     SystemMessage,
 )
-from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
 import os
 import logging
-import numpy as np
+
+# NumPy (and Numba) are only needed by the embedding classes, which import them
+# on construction, so chat-only callers don't pay for them at import time
+if TYPE_CHECKING:
+    import numpy as np
+    from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
 
 logger = logging.getLogger(__name__)
 
+# Connect and read timeouts (seconds) for every Grok API call, sync and async, so a
+# stalled connection fails as a (retriable) timeout instead of holding a thread
+CONNECT_TIMEOUT_SECONDS = 10.0
+READ_TIMEOUT_SECONDS = 60.0
+_SESSION_TIMEOUT = (CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS)
+
+# Shared sessions so sync calls reuse keep-alive connections instead of a new TCP + TLS
+# handshake per request. _SESSION's adapter retries the model list GET (urllib3 retries
+# connection errors for every method, whatever allowed_methods says)
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset({"GET"}),
+    ),
+))
+
+# Chat completion POSTs are retried by _retry_transient alone; an adapter that never
+# retries keeps urllib3's connect retries from multiplying with it
+_CHAT_SESSION = requests.Session()
+_CHAT_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=0,
+))
+
+# How long a fetched model list is reused before asking the API again
+MODELS_CACHE_TTL_SECONDS = 600
+
+@functools.lru_cache(maxsize=8)
+def _fetch_models_for_period(api_key: str, base_url: str, period: int) -> frozenset:
+    """List model ids from the API; `period` only exists to expire cache entries"""
+    response = _SESSION.get(
+        f"{base_url}/models",
+        headers={"Authorization": f"Bearer {api_key}"},
+        timeout=_SESSION_TIMEOUT
+    )
+    if response.status_code != 200:
+        # Raising (rather than returning) keeps failures out of the cache
+        raise ValueError(f"Error checking models: {response.status_code}, {response.text}")
+    return frozenset(model.get("id") for model in orjson.loads(response.content).get("data", []))
+
+def _fetch_available_models(api_key: str, base_url: str) -> frozenset:
+    """List model ids available to this API key, shared across instances for up to 10 minutes"""
+    period = int(time.monotonic() // MODELS_CACHE_TTL_SECONDS)
+    return _fetch_models_for_period(api_key, base_url, period)
+
+class _TTLResponseCache:
+    """In-process cache of chat completion responses (same lookup/update shape as LangChain's BaseCache)"""
+    
+    def __init__(self, maxsize: int = 2048, ttl: int = 1800):
+        self._cache = cachetools.TTLCache(maxsize=maxsize, ttl=ttl)
+        # TTLCache isn't thread-safe and requests are served from a threadpool
+        self._lock = threading.Lock()
+    
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._cache.get(key)
+    
+    def update(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._cache[key] = value
+
+class _RedisResponseCache:
+    """Chat completion response cache in Redis, shared by all worker processes"""
+    
+    def __init__(self, url: str, ttl: int = 1800):
+        import redis  # Optional dependency, only needed when GROK_CACHE_REDIS_URL is set
+        self._client = redis.Redis.from_url(url)
+        self._ttl = ttl
+    
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            value = self._client.get(f"grok:{key}")
+        except Exception as e:
+            logger.warning(f"Redis cache lookup failed: {str(e)}")
+            return None
+        return orjson.loads(value) if value is not None else None
+    
+    def update(self, key: str, value: Dict[str, Any]) -> None:
+        try:
+            self._client.set(f"grok:{key}", orjson.dumps(value), ex=self._ttl)
+        except Exception as e:
+            logger.warning(f"Redis cache update failed: {str(e)}")
+
+def _create_response_cache():
+    redis_url = os.environ.get("GROK_CACHE_REDIS_URL")
+    if redis_url:
+        try:
+            return _RedisResponseCache(redis_url)
+        except ImportError:
+            logger.warning("GROK_CACHE_REDIS_URL is set but redis is not installed; using in-memory cache")
+    return _TTLResponseCache()
+
+_RESPONSE_CACHE = _create_response_cache()
+
+# Rate limiting and transient server errors are worth retrying; other statuses are not
+_TRANSIENT_STATUS = frozenset({429, 500, 502, 503, 504})
+
+def _is_transient(exc: BaseException) -> bool:
+    """Whether a failed Grok API call may succeed if retried"""
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout, httpx.TransportError)):
+        return True
+    if isinstance(exc, (requests.HTTPError, httpx.HTTPStatusError)):
+        return exc.response is not None and exc.response.status_code in _TRANSIENT_STATUS
+    return False
+
+# Retry transient failures with exponential backoff and jitter, then re-raise the last error
+_retry_transient = tenacity.retry(
+    stop=tenacity.stop_after_attempt(4),
+    wait=tenacity.wait_exponential_jitter(initial=1, max=10),
+    retry=tenacity.retry_if_exception(_is_transient),
+    before_sleep=lambda state: logger.warning(f"Retrying Grok API call after error: {state.outcome.exception()}"),
+    reraise=True,
+)
+
+# Failures a chat call is expected to hit: network/HTTP errors and malformed responses
+_API_ERRORS = (requests.RequestException, httpx.HTTPError, KeyError, IndexError, ValueError)
+
+# Maximum number of concurrent async requests to the Grok API per event loop
+GROK_CONCURRENCY = int(os.environ.get("GROK_CONCURRENCY", "8"))
+
+# HTTP/2 lets concurrent requests share one multiplexed connection; it needs the
+# optional h2 package (httpx[http2]), so fall back to HTTP/1.1 without it
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+# httpx.AsyncClient and asyncio.Semaphore are tied to the event loop they are used on,
+# so keep one of each per loop
+_async_clients = weakref.WeakKeyDictionary()
+_async_semaphores = weakref.WeakKeyDictionary()
+
+def _get_async_client() -> httpx.AsyncClient:
+    """Get the pooled async HTTP client for the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            http2=_HTTP2,
+            timeout=httpx.Timeout(READ_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=32),
+        )
+        _async_clients[loop] = client
+    return client
+
+def _get_async_semaphore() -> asyncio.Semaphore:
+    """Get the semaphore bounding in-flight async requests on the running event loop"""
+    loop = asyncio.get_running_loop()
+    semaphore = _async_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(GROK_CONCURRENCY)
+        _async_semaphores[loop] = semaphore
+    return semaphore
+
+# Fallback models when the configured one is unavailable, in order of preference
+_PREFERRED_MODELS = (
+    "llama-3.1-8b-instant",
+    "llama-3.3-70b-versatile",
+    "gemma2-9b-it",
+    "qwen/qwen3-32b",
+    "openai/gpt-oss-20b",
+)
+
+@functools.lru_cache(maxsize=8)
+def _alternative_model(available_models: frozenset) -> Optional[str]:
+    """Pick a replacement model from a model list; cached alongside the list itself"""
+    for model in _PREFERRED_MODELS:
+        if model in available_models:
+            return model
+    # Otherwise use the first text model (whisper models are speech-to-text)
+    text_models = sorted(m for m in available_models if not m.startswith("whisper"))
+    return text_models[0] if text_models else None
+
+# Placeholder replies returned (flagged, see GrokChatModel._mock_result) instead of raising
+_MODEL_UNAVAILABLE_MESSAGE = "I'm unable to provide a specific response at this time due to model availability issues. This is a placeholder response."
+_API_ERROR_MESSAGE = "I encountered an error while processing your request. This is a placeholder response."
+
+def _raise_for_api_error(response: Union[requests.Response, httpx.Response], log_level: int = logging.ERROR) -> None:
+    """Raise for a non-200 Grok API response from either HTTP client.
+
+    Error statuses raise the client's HTTP error so _is_transient can see the status code.
+    """
+    if response.status_code == 200:
+        return
+    logger.log(log_level, f"Error from Grok API: {response.status_code}, {response.text}")
+    response.raise_for_status()
+    raise ValueError(f"Error from Grok API: {response.text}")
+
+# APIs known to return a single choice per request: generate_n skips the combined
+# request for these. Groq currently rejects n > 1; others are added when they do.
+_SINGLE_CHOICE_BASE_URLS = {"https://api.groq.com/openai/v1"}
+
+# API role for each supported message type
+_ROLE = {HumanMessage: "user", AIMessage: "assistant", SystemMessage: "system"}
+
+def _role_of(message: BaseMessage) -> str:
+    role = _ROLE.get(type(message))
+    if role is not None:
+        return role
+    for message_type, role in _ROLE.items():
+        if isinstance(message, message_type):
+            return role
+    raise ValueError(f"Unknown message type: {type(message)}")
+
 class GrokChatModel(BaseChatModel):
     """Chat model for Grok AI API."""
 
@@ -26,6 +252,12 @@ class GrokChatModel(BaseChatModel):
     temperature: float = 0.7
     max_tokens: Optional[int] = None
     base_url: str = "https://api.groq.com/openai/v1"
+    # Reuse responses for identical requests. Always on at temperature 0, where the
+    # output is deterministic; set this to also cache sampled responses.
+    response_cache: bool = False
+    # Check model_name against the API's model list (and switch to an available
+    # alternative) before the first request; off by default to skip the round trip
+    validate_models: bool = False
     
     @property
     def _llm_type(self) -> str:
@@ -33,77 +265,151 @@ class GrokChatModel(BaseChatModel):
 
     def _format_messages(self, messages: List[BaseMessage]) -> List[Dict[str, str]]:
         """Format messages for Grok API."""
-        formatted_messages = []
-        for message in messages:
-            if isinstance(message, HumanMessage):
-                role = "user"
-            elif isinstance(message, AIMessage):
-                role = "assistant"
-            elif isinstance(message, SystemMessage):
-                role = "system"
-            else:
-                raise ValueError(f"Unknown message type: {type(message)}")
-            
-            formatted_messages.append({
-                "role": role,
-                "content": message.content
-            })
-        return formatted_messages
+        try:
+            return [{"role": _ROLE[type(message)], "content": message.content} for message in messages]
+        except KeyError:
+            # Subclasses of the supported message types miss the exact-type lookup
+            return [{"role": _role_of(message), "content": message.content} for message in messages]
 
     def _validate_available_models(self):
         """Check if the specified model is available"""
+        if not self.validate_models:
+            return True
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            
-            response = requests.get(
-                f"{self.base_url}/models",
-                headers=headers
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"Error checking models: {response.status_code}, {response.text}")
-                return False
-                
-            models = response.json()
-            available_models = [model.get('id') for model in models.get("data", [])]
+            available_models = _fetch_available_models(self.api_key, self.base_url)
             
             if self.model_name not in available_models:
-                # Try to find a suitable alternative
-                logger.warning(f"Model {self.model_name} not found. Available models: {available_models}")
-                
-                # Try to find one of these models in order of preference
-                preferred_models = [
-                    "llama-3.1-8b-instant",
-                    "llama-3.3-70b-versatile", 
-                    "gemma2-9b-it",
-                    "qwen/qwen3-32b",
-                    "openai/gpt-oss-20b"
-                ]
-                
-                for model in preferred_models:
-                    if model in available_models:
-                        self.model_name = model
-                        logger.info(f"Using alternative model: {self.model_name}")
-                        return True
-                
-                # If none of the preferred models are available, use the first available model
-                if available_models:
-                    # Skip whisper models as they're for speech-to-text
-                    text_models = [m for m in available_models if not m.startswith("whisper")]
-                    if text_models:
-                        self.model_name = text_models[0]
-                        logger.info(f"Using first available text model: {self.model_name}")
-                        return True
-                
-                return False
+                logger.warning(f"Model {self.model_name} not found. Available models: {sorted(available_models)}")
+                alternative = _alternative_model(available_models)
+                if alternative is None:
+                    return False
+                self.model_name = alternative
+                logger.info(f"Using alternative model: {self.model_name}")
             
             return True
-        except Exception as e:
+        except (requests.RequestException, ValueError) as e:
             logger.error(f"Error validating models: {str(e)}")
             return False
 
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+
+    def _build_payload(self, messages: List[BaseMessage], stop: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Build the chat completions request body."""
+        data = {
+            "model": self.model_name,
+            "messages": self._format_messages(messages),
+            "temperature": self.temperature,
+        }
+        
+        if self.max_tokens:
+            data["max_tokens"] = self.max_tokens
+        
+        if stop:
+            data["stop"] = stop
+        return data
+
+    @staticmethod
+    def _encode_payload(data: Dict[str, Any]) -> bytes:
+        """Serialize a request body once; sorted keys make it usable as a cache key too."""
+        return orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+
+    def _response_cache_key(self, body: bytes) -> Optional[str]:
+        """Cache key for an encoded request body, or None if this request shouldn't be cached."""
+        if not (self.response_cache or self.temperature == 0):
+            return None
+        hasher = hashlib.blake2b(self.base_url.encode())
+        hasher.update(b"\0")
+        hasher.update(body)
+        return hasher.hexdigest()
+
+    def _create_chat_result(self, response_json: Dict[str, Any]) -> ChatResult:
+        """Convert a chat completions response into a ChatResult."""
+        message_content = response_json["choices"][0]["message"]["content"]
+        message = AIMessage(content=message_content)
+        
+        generation = ChatGeneration(
+            message=message,
+            generation_info=dict(
+                finish_reason=response_json["choices"][0].get("finish_reason"),
+                logprobs=response_json.get("logprobs"),
+            )
+        )
+        
+        token_usage = response_json.get("usage", {})
+        
+        return ChatResult(
+            generations=[generation],
+            llm_output={
+                "token_usage": token_usage,
+                "model_name": self.model_name,
+            },
+        )
+
+    def _mock_result(self, content: str) -> ChatResult:
+        """Build a placeholder ChatResult used when the API can't be reached.
+
+        The message is flagged with response_metadata["placeholder"] so callers
+        can tell it apart from a real answer (and avoid caching it).
+        """
+        message = AIMessage(content=content, response_metadata={"placeholder": True})
+        
+        return ChatResult(
+            generations=[ChatGeneration(message=message, generation_info={"placeholder": True})],
+            llm_output={
+                "token_usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                "model_name": self.model_name,
+                "placeholder": True,
+            },
+        )
+
+    @staticmethod
+    def _mock_chunk(content: str) -> ChatGenerationChunk:
+        """Streaming counterpart of _mock_result."""
+        return ChatGenerationChunk(message=AIMessageChunk(content=content, response_metadata={"placeholder": True}))
+
+    @_retry_transient
+    def _post_chat(self, body: bytes, log_level: int = logging.ERROR) -> Dict[str, Any]:
+        """Send a chat completions request and return the parsed response."""
+        response = _CHAT_SESSION.post(
+            f"{self.base_url}/chat/completions",
+            headers=self._headers(),
+            data=body,
+            timeout=_SESSION_TIMEOUT
+        )
+        _raise_for_api_error(response, log_level)
+        return orjson.loads(response.content)
+
+    @_retry_transient
+    async def _apost_chat(self, body: bytes) -> Dict[str, Any]:
+        """Async version of _post_chat."""
+        # Only hold a concurrency slot while the request is in flight, not during backoff
+        async with _get_async_semaphore():
+            response = await _get_async_client().post(
+                f"{self.base_url}/chat/completions",
+                headers=self._headers(),
+                content=body
+            )
+        _raise_for_api_error(response)
+        return orjson.loads(response.content)
+
+    @_retry_transient
+    def _open_stream(self, body: bytes) -> requests.Response:
+        """Start a streaming chat completions request; the caller must close the response."""
+        response = _CHAT_SESSION.post(
+            f"{self.base_url}/chat/completions",
+            headers=self._headers(),
+            data=body,
+            stream=True,
+            timeout=_SESSION_TIMEOUT
+        )
+        # Reading the error body releases the connection, so only successful streams need closing
+        _raise_for_api_error(response)
+        return response
+
     def _generate(
         self, 
         messages: List[BaseMessage], 
@@ -119,109 +425,349 @@ class GrokChatModel(BaseChatModel):
         # If model validation failed, generate a mock response
         if not getattr(self, "_model_validated", False):
             logger.warning("Using mock response because model validation failed")
-            message = AIMessage(content="I'm unable to provide a specific response at this time due to model availability issues. This is a placeholder response.")
-            
-            return ChatResult(
-                generations=[ChatGeneration(message=message)],
-                llm_output={
-                    "token_usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
-                    "model_name": self.model_name,
-                },
-            )
+            return self._mock_result(_MODEL_UNAVAILABLE_MESSAGE)
         
         # Regular generation logic
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-
-        data = {
-            "model": self.model_name,
-            "messages": self._format_messages(messages),
-            "temperature": self.temperature,
-        }
-        
-        if self.max_tokens:
-            data["max_tokens"] = self.max_tokens
+        body = self._encode_payload(self._build_payload(messages, stop))
         
-        if stop:
-            data["stop"] = stop
+        cache_key = self._response_cache_key(body)
+        if cache_key is not None:
+            cached = _RESPONSE_CACHE.lookup(cache_key)
+            if cached is not None:
+                logger.info("Using cached Grok response")
+                return self._create_chat_result(cached)
             
         try:
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=headers,
-                json=data
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"Error from Grok API: {response.status_code}, {response.text}")
-                raise ValueError(f"Error from Grok API: {response.text}")
-                
-            response_json = response.json()
-            
-            message_content = response_json["choices"][0]["message"]["content"]
-            message = AIMessage(content=message_content)
-            
-            generation = ChatGeneration(
-                message=message,
-                generation_info=dict(
-                    finish_reason=response_json["choices"][0].get("finish_reason"),
-                    logprobs=response_json.get("logprobs"),
-                )
-            )
-            
-            token_usage = response_json.get("usage", {})
-            
-            return ChatResult(
-                generations=[generation],
-                llm_output={
-                    "token_usage": token_usage,
-                    "model_name": self.model_name,
-                },
-            )
-        except Exception as e:
+            response_json = self._post_chat(body)
+            result = self._create_chat_result(response_json)
+            if cache_key is not None:
+                _RESPONSE_CACHE.update(cache_key, response_json)
+            return result
+        except _API_ERRORS as e:
             logger.error(f"Error in _generate: {str(e)}")
+            # Transient failures that outlasted the retries are left to the caller
+            if _is_transient(e):
+                raise
             # Return a mock response
-            message = AIMessage(content="I encountered an error while processing your request. This is a placeholder response.")
-            
-            return ChatResult(
-                generations=[ChatGeneration(message=message)],
-                llm_output={
-                    "token_usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
-                    "model_name": self.model_name,
-                },
-            )  
+            return self._mock_result(_API_ERROR_MESSAGE)
+
+    def generate_n(
+        self,
+        messages: List[BaseMessage],
+        n: int,
+        stop: Optional[List[str]] = None,
+    ) -> List[AIMessage]:
+        """Sample n completions of the same prompt, in a single request where the API allows it."""
+        if n <= 1:
+            return [self.invoke(messages, stop=stop)]
+        
+        if not hasattr(self, "_model_validated"):
+            self._model_validated = self._validate_available_models()
+        
+        completions = []
+        if getattr(self, "_model_validated", False) and self.base_url not in _SINGLE_CHOICE_BASE_URLS:
+            data = self._build_payload(messages, stop)
+            data["n"] = n
+            try:
+                # A rejection is expected from APIs without n support, so don't log it as an error
+                choices = self._post_chat(self._encode_payload(data), log_level=logging.INFO).get("choices", [])
+                completions = [AIMessage(content=choice["message"]["content"]) for choice in choices]
+                if len(completions) < n:
+                    _SINGLE_CHOICE_BASE_URLS.add(self.base_url)
+            except requests.HTTPError as e:
+                # Bad-request statuses mean n itself was refused; anything else (auth,
+                # rate limits, outages) says nothing about n support
+                if e.response is not None and e.response.status_code in (400, 422):
+                    logger.info(f"{self.base_url} does not support n={n}; using single requests from now on")
+                    _SINGLE_CHOICE_BASE_URLS.add(self.base_url)
+                else:
+                    logger.warning(f"Request with n={n} failed: {str(e)}")
+            except _API_ERRORS as e:
+                logger.warning(f"Request with n={n} failed: {str(e)}")
+        
+        # Providers that reject or ignore n > 1 get the rest as concurrent single requests
+        missing = n - len(completions)
+        if missing > 0:
+            logger.info(f"Requesting {missing} of {n} completions separately")
+            completions.extend(self.batch([messages] * missing, stop=stop))
+        return completions[:n]
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        """Stream a chat response from Grok token by token (server-sent events).
+
+        Used by stream(); streamed responses bypass the response cache.
+        """
+        if not hasattr(self, "_model_validated"):
+            self._model_validated = self._validate_available_models()
+        
+        if not getattr(self, "_model_validated", False):
+            logger.warning("Using mock response because model validation failed")
+            yield self._mock_chunk(_MODEL_UNAVAILABLE_MESSAGE)
+            return
+        
+        data = self._build_payload(messages, stop)
+        data["stream"] = True
+        
+        emitted = False
+        try:
+            with self._open_stream(self._encode_payload(data)) as response:
+                for line in response.iter_lines():
+                    # Skip keep-alives and anything that isn't an SSE data line
+                    if not line.startswith(b"data: "):
+                        continue
+                    payload = line[len(b"data: "):]
+                    if payload == b"[DONE]":
+                        break
+                    choices = orjson.loads(payload).get("choices")
+                    if not choices:
+                        continue
+                    delta = choices[0].get("delta", {}).get("content") or ""
+                    finish_reason = choices[0].get("finish_reason")
+                    if not delta and finish_reason is None:
+                        continue
+                    
+                    chunk = ChatGenerationChunk(
+                        message=AIMessageChunk(content=delta),
+                        generation_info=dict(finish_reason=finish_reason) if finish_reason else None,
+                    )
+                    if run_manager and delta:
+                        run_manager.on_llm_new_token(delta, chunk=chunk)
+                    emitted = True
+                    yield chunk
+        except _API_ERRORS as e:
+            logger.error(f"Error in _stream: {str(e)}")
+            # Tokens already sent can't be taken back, and transient failures that
+            # outlasted the retries are left to the caller
+            if emitted or _is_transient(e):
+                raise
+            yield self._mock_chunk(_API_ERROR_MESSAGE)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """Generate a chat response from Grok without blocking the event loop.
+
+        Used by ainvoke/abatch; concurrent calls share a pooled connection and are
+        limited to GROK_CONCURRENCY in flight.
+        """
+        if not hasattr(self, "_model_validated"):
+            # Model validation uses the blocking client, so run it in a thread
+            self._model_validated = (
+                await asyncio.to_thread(self._validate_available_models) if self.validate_models else True
+            )
+        
+        if not getattr(self, "_model_validated", False):
+            logger.warning("Using mock response because model validation failed")
+            return self._mock_result(_MODEL_UNAVAILABLE_MESSAGE)
+        
+        body = self._encode_payload(self._build_payload(messages, stop))
+        
+        cache_key = self._response_cache_key(body)
+        if cache_key is not None:
+            cached = _RESPONSE_CACHE.lookup(cache_key)
+            if cached is not None:
+                logger.info("Using cached Grok response")
+                return self._create_chat_result(cached)
+        
+        try:
+            response_json = await self._apost_chat(body)
+            result = self._create_chat_result(response_json)
+            if cache_key is not None:
+                _RESPONSE_CACHE.update(cache_key, response_json)
+            return result
+        except _API_ERRORS as e:
+            logger.error(f"Error in _agenerate: {str(e)}")
+            if _is_transient(e):
+                raise
+            return self._mock_result(_API_ERROR_MESSAGE)
+
+async def _batch(model: BaseChatModel, batches: List[List[BaseMessage]], concurrency: int) -> List[BaseMessage]:
+    # batch_chat owns this event loop, so size GrokChatModel's per-loop request limit
+    # to `concurrency` rather than letting GROK_CONCURRENCY cap it
+    loop = asyncio.get_running_loop()
+    _async_semaphores[loop] = asyncio.Semaphore(concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def one(messages: List[BaseMessage]) -> BaseMessage:
+        async with semaphore:
+            return await model.ainvoke(messages)
+    
+    try:
+        return await asyncio.gather(*(one(messages) for messages in batches))
+    finally:
+        # The loop ends with this call, so close its pooled client instead of leaving
+        # the sockets open until garbage collection
+        _async_semaphores.pop(loop, None)
+        client = _async_clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+
+def batch_chat(model: BaseChatModel, batches: List[List[BaseMessage]], concurrency: int = 8) -> List[BaseMessage]:
+    """Run several independent conversations concurrently and return the replies in order.
+
+    Starts its own event loop, so call it from synchronous code; async callers
+    should use model.abatch instead (limited to GROK_CONCURRENCY requests per loop).
+    Connections are pooled within one call and closed when it returns.
+    """
+    return asyncio.run(_batch(model, batches, concurrency))
+
+def _normalize_rows(vecs: np.ndarray) -> np.ndarray:
+    """L2-normalize the rows of a float matrix in place"""
+    import numpy as np
+    
+    # One streaming pass for the squared norms, then an in-place reciprocal sqrt
+    # and a single scaling pass; no temporaries the size of the matrix
+    scale = np.einsum("ij,ij->i", vecs, vecs)
+    np.maximum(scale, 1e-24, out=scale)  # guard against zero vectors
+    np.sqrt(scale, out=scale)
+    np.reciprocal(scale, out=scale)
+    vecs *= scale[:, None]
+    return vecs
+
+@functools.lru_cache(maxsize=None)
+def _fill_normed_kernel():
+    """The compiled SimpleEmbeddings kernel, or None if Numba isn't installed"""
+    try:
+        from app.utils.numba_kernels import fill_normed
+    except ImportError:  # Optional; SimpleEmbeddings falls back to NumPy
+        return None
+    return fill_normed
 
 class SimpleEmbeddings(Embeddings):
-    """A fallback embedding class that creates random embeddings for testing"""
+    """A fallback embedding class that creates random embeddings for testing.
+    
+    Vectors are seeded from a hash of the text, so the same text always gets the same embedding.
+    """
     
     def __init__(self, embedding_dim=1536):
+        import numpy as np
+        self._np = np
         self.embedding_dim = embedding_dim
         logger.info(f"Using SimpleEmbeddings with dimension {embedding_dim}")
+    
+    @staticmethod
+    def _text_key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode(), digest_size=16).digest()
+    
+    def _seeded_unit_vectors(self, keys: List[bytes]) -> np.ndarray:
+        """Generate one random unit vector per text key as a float32 matrix"""
+        np = self._np
+        vecs = np.empty((len(keys), self.embedding_dim), dtype=np.float32)
+        fill_normed = _fill_normed_kernel()
+        if fill_normed is not None:
+            # The first call compiles the kernel; cache=True keeps it on disk for later runs.
+            # Numba only accepts 32-bit seeds
+            seeds = np.array([int.from_bytes(key[:4], "little") for key in keys], dtype=np.uint32)
+            fill_normed(vecs, seeds)
+            return vecs
+        for row, key in zip(vecs, keys):
+            np.random.default_rng(int.from_bytes(key[:8], "little")).standard_normal(dtype=np.float32, out=row)
+        return _normalize_rows(vecs)
         
+    def embed_documents_np(self, texts: List[str]) -> np.ndarray:
+        """Create random embeddings for documents as a float32 matrix"""
+        logger.info(f"Embedding {len(texts)} documents with SimpleEmbeddings")
+        # Embed each distinct text once, then scatter the rows back to input order
+        keys = [self._text_key(text) for text in texts]
+        unique_keys = list(dict.fromkeys(keys))
+        vecs = self._seeded_unit_vectors(unique_keys)
+        if len(unique_keys) == len(keys):
+            return vecs
+        logger.info(f"Embedding {len(unique_keys)} unique texts out of {len(keys)}")
+        row_of = {key: i for i, key in enumerate(unique_keys)}
+        return vecs[[row_of[key] for key in keys]]
+    
+    def embed_query_np(self, text: str) -> np.ndarray:
+        """Create a random embedding for a query as a float32 vector"""
+        logger.info(f"Embedding query with SimpleEmbeddings")
+        return self._seeded_unit_vectors([self._text_key(text)])[0]
+    
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """Create random embeddings for documents"""
-        logger.info(f"Embedding {len(texts)} documents with SimpleEmbeddings")
         if not texts:
             # Return a single dummy embedding if texts is empty
             logger.warning("Empty texts list provided to embed_documents")
             return [[0.0] * self.embedding_dim]
+        return self.embed_documents_np(texts).tolist()
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Create a random embedding for a query"""
+        return self.embed_query_np(text).tolist()
+
+class MiniLMEmbeddings(Embeddings):
+    """all-MiniLM-L6-v2 sentence embeddings run on CPU with ONNX Runtime"""
+    
+    def __init__(self, model_dir: str, max_length: int = 256, batch_size: int = 32):
+        # Optional dependencies; callers fall back to SimpleEmbeddings if these are missing
+        import numpy as np
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        self._np = np
+        
+        # Prefer the int8-quantized export when present
+        model_path = os.path.join(model_dir, "model_quantized.onnx")
+        if not os.path.exists(model_path):
+            model_path = os.path.join(model_dir, "model.onnx")
+        tokenizer_path = os.path.join(model_dir, "tokenizer.json")
+        for path in (model_path, tokenizer_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"MiniLM model file not found: {path}")
+        
+        self.session = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        self._input_names = {model_input.name for model_input in self.session.get_inputs()}
+        output_dim = self.session.get_outputs()[0].shape[-1]
+        self.embedding_dim = output_dim if isinstance(output_dim, int) else 384
+        
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+        logger.info(f"Using MiniLMEmbeddings from {model_path} with dimension {self.embedding_dim}")
+    
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        """Mean-pooled, L2-normalized embeddings as a float32 matrix"""
+        np = self._np
+        embeddings = np.empty((len(texts), self.embedding_dim), dtype=np.float32)
+        for start in range(0, len(texts), self.batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + self.batch_size])
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self._input_names:
+                inputs["token_type_ids"] = np.zeros_like(input_ids)
             
-        embeddings = []
-        for _ in texts:
-            # Create a random embedding vector and normalize it
-            vec = np.random.randn(self.embedding_dim)
-            vec = vec / np.linalg.norm(vec)
-            embeddings.append(vec.tolist())
+            token_embeddings = self.session.run(None, inputs)[0]
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            embeddings[start:start + len(encodings)] = _normalize_rows(pooled)
         return embeddings
     
+    def embed_documents_np(self, texts: List[str]) -> np.ndarray:
+        """Embed documents with MiniLM as a float32 matrix"""
+        logger.info(f"Embedding {len(texts)} documents with MiniLMEmbeddings")
+        return self._embed(texts)
+    
+    def embed_query_np(self, text: str) -> np.ndarray:
+        """Embed a query with MiniLM as a float32 vector"""
+        return self._embed([text])[0]
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents with MiniLM"""
+        return self.embed_documents_np(texts).tolist()
+    
     def embed_query(self, text: str) -> List[float]:
-        """Create a random embedding for a query"""
-        logger.info(f"Embedding query with SimpleEmbeddings")
-        vec = np.random.randn(self.embedding_dim)
-        vec = vec / np.linalg.norm(vec)
-        return vec.tolist()
+        """Embed a query with MiniLM"""
+        return self.embed_query_np(text).tolist()
 
 class GrokEmbeddings(Embeddings):
     """Embeddings model for Grok API (fallback to SimpleEmbeddings)."""
@@ -232,6 +778,16 @@ class GrokEmbeddings(Embeddings):
         self._simple_embeddings = SimpleEmbeddings()
         logger.warning("GrokEmbeddings initialized but will use SimpleEmbeddings as fallback due to model compatibility issues")
         
+    def embed_documents_np(self, texts: List[str]) -> np.ndarray:
+        """Use SimpleEmbeddings as fallback."""
+        logger.info(f"Using SimpleEmbeddings fallback for {len(texts)} documents")
+        return self._simple_embeddings.embed_documents_np(texts)
+    
+    def embed_query_np(self, text: str) -> np.ndarray:
+        """Use SimpleEmbeddings as fallback."""
+        logger.info("Using SimpleEmbeddings fallback for query")
+        return self._simple_embeddings.embed_query_np(text)
+    
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """Use SimpleEmbeddings as fallback."""
         logger.info(f"Using SimpleEmbeddings fallback for {len(texts)} documents")
@@ -0,0 +1,25 @@
+# backend/app/utils/numba_kernels.py
+# Compiled helpers for SimpleEmbeddings. Importing this module requires Numba,
+# so grok_integration only imports it on first use and falls back to NumPy.
+import math
+import numpy as np
+from numba import njit
+
+
+# Not parallel=True: the kernel is called from several uvicorn threadpool threads at
+# once, which Numba's default workqueue threading layer aborts on (and TBB can hang at exit)
+@njit(fastmath=True, cache=True)
+def fill_normed(out, seeds):
+    """Fill row i of `out` with a random unit vector seeded by seeds[i] (compiled)"""
+    n, d = out.shape
+    for i in range(n):
+        # Numba keeps one generator per calling thread, so concurrent callers don't share state
+        np.random.seed(seeds[i])
+        s = 0.0
+        for j in range(d):
+            x = np.random.randn()
+            out[i, j] = x
+            s += x * x
+        inv = 1.0 / math.sqrt(max(s, 1e-24))
+        for j in range(d):
+            out[i, j] *= inv
@@ -1,7 +1,8 @@
 # backend/test_grok.py
 import os
 from dotenv import load_dotenv
-from app.utils.grok_integration import GrokChatModel, GrokEmbeddings
+import time
+from app.utils.grok_integration import GrokChatModel, GrokEmbeddings, batch_chat
 
 # Load environment variables
 load_dotenv()
@@ -23,6 +24,37 @@ def test_chat():
     response = chat_model.invoke(messages)
     print("Chat Response:", response.content)
 
+# Test concurrent chat requests
+def test_batch_chat():
+    chat_model = GrokChatModel(
+        api_key=os.environ.get("GROK_API_KEY"),
+        temperature=0.7
+    )
+    
+    from langchain_core.messages import HumanMessage, SystemMessage
+    
+    questions = [
+        "What is retrieval-augmented generation?",
+        "What is a vector database?",
+        "What is an embedding?",
+        "What is cosine similarity?",
+        "What is a text chunk?",
+        "What is a language model?",
+        "What is tokenization?",
+        "What is semantic search?",
+    ]
+    batches = [
+        [SystemMessage(content="Answer in one sentence."), HumanMessage(content=question)]
+        for question in questions
+    ]
+    
+    for concurrency in (1, 4, 8):
+        start = time.perf_counter()
+        responses = batch_chat(chat_model, batches, concurrency=concurrency)
+        elapsed = time.perf_counter() - start
+        print(f"concurrency={concurrency}: {len(responses)} responses in {elapsed:.2f}s")
+    print("Last Response:", responses[-1].content)
+
 # Test embeddings
 def test_embeddings():
     embedding_model = GrokEmbeddings(api_key=os.environ.get("GROK_API_KEY"))
@@ -37,5 +69,8 @@ if __name__ == "__main__":
     print("Testing Grok Chat model...")
     test_chat()
     
+    print("\nTesting concurrent Grok Chat requests...")
+    test_batch_chat()
+    
     print("\nTesting Grok Embeddings...")
     test_embeddings()
\ No newline at end of file
@@ -1,8 +1,8 @@
 # backend/test_grok_models.py
 import os
-import requests
 import logging
 from dotenv import load_dotenv
+from app.utils.grok_integration import _SESSION, _SESSION_TIMEOUT
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -23,9 +23,10 @@ def list_grok_models():
     }
     
     try:
-        response = requests.get(
+        response = _SESSION.get(
             "https://api.groq.com/openai/v1/models",
-            headers=headers
+            headers=headers,
+            timeout=_SESSION_TIMEOUT
         )
         
         if response.status_code != 200: